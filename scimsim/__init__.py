@@ -1,6 +1,13 @@
 from .app import app
 from .app import users
 from .app import groups
+from .app import user_indexes
+from .app import group_indexes
+from .app import membership_graph
+from . import indexes
+from . import memberships
+from .schemas import add_schema_extension
+from .schemas import remove_schema_extension
 
 def create_client():
     return app.test_client()
@@ -8,3 +15,6 @@ def create_client():
 def clear_data():
     users.clear()
     groups.clear()
+    indexes.clear(user_indexes)
+    indexes.clear(group_indexes)
+    memberships.clear(membership_graph)
@@ -1,29 +1,48 @@
 #!/usr/local/bin/python3
 import datetime 
 import hashlib
+import json
 import re
 import urllib.parse
 from flask import Flask, request, abort, jsonify, make_response, Response
+from . import indexes
+from . import memberships
+from . import profiling
+from . import schemas
 
 app = Flask(__name__)
 
+MAX_RESULTS = 200
+
 users = []
 groups = []
+user_indexes = indexes.create_indexes('User', ['userName', 'externalId'])
+group_indexes = indexes.create_indexes('Group', ['id', 'displayName', 'externalId'])
+membership_graph = memberships.create_graph()
 
 @app.before_request
 def log_request_info():
-    print('\n>>> {} {} {}'.format(request.method, request.path, request.environ.get('SERVER_PROTOCOL')))
-    print(*['\n>>> {}: {}'.format(x[0], x[1]) for x in request.headers ])
-    print('\n>>> {}'.format(request.get_data()))
+    profiling.start_request('{} {}'.format(request.method, request.url_rule or request.path))
+
+    with profiling.phase('log'):
+        print('\n>>> {} {} {}'.format(request.method, request.path, request.environ.get('SERVER_PROTOCOL')))
+        print(*['\n>>> {}: {}'.format(x[0], x[1]) for x in request.headers ])
+        print('\n>>> {}'.format(request.get_data()))
 
 
 @app.after_request
 def after(response):
-    print('\n<<< {}'.format(response.status))
-    print(*['\n<<< {}: {}'.format(x[0], x[1]) for x in response.headers ])
-    print('\n<<< {}'.format(response.get_data()))
+    with profiling.phase('log'):
+        print('\n<<< {}'.format(response.status))
+        print(*['\n<<< {}: {}'.format(x[0], x[1]) for x in response.headers ])
+        print('\n<<< {}'.format(response.get_data()))
+
+    return profiling.add_server_timing(response)
 
-    return response
+
+@app.teardown_request
+def teardown(error):
+    profiling.end_request()
 
 
 @app.errorhandler(404)
@@ -31,62 +50,67 @@ def not_found(error):
     return make_scim_response(create_error_payload(404, 'Not found'), 404)
 
 
+@app.route('/scim/v2/Users', methods=['POST'])
 @app.route('/scim/v2/users', methods=['POST'])
 def create_user():
-    if not request.json or not 'userName' in request.json:
-        scim_abort(400, 'userName is missing')
+    payload = validate_payload('User')
 
-    alreadyExists = next((u for u in users if u['userName'] == request.json['userName']), None)
+    with profiling.phase('lookup'):
+        alreadyExists = indexes.lookup(user_indexes, 'userName', payload['userName'])
     if alreadyExists:
         scim_abort(409, 'user already exists')
 
-    now = get_current_datetime()
-    id = users[-1]['id'] + 1 if len(users) > 0 else 0
-    user = {
-        'schemas' : ['urn:ietf:params:scim:schemas:core:2.0:User'],
-        'id': id,
-        'userName': request.json['userName'],
-        'externalId': request.json.get('externalId', ""),
-        'active': True,
-        'meta': {
+    with profiling.phase('mutate'):
+        now = get_current_datetime()
+        id = users[-1]['id'] + 1 if len(users) > 0 else 0
+        user = {
+            'id': id,
+            'externalId': "",
+            'active': True
+        }
+        user.update(payload)
+        user['meta'] = {
             'resourceType': 'User',
             'created': now,
             'modified': now,
             'location': get_location('/scim/v2/users', id),
             'version': get_version(now, now)
         }
-    }
 
-    if 'name' in request.json:
-        user['name'] = request.json['name']
-        
-    users.append(user)
+        users.append(user)
+        indexes.add(user_indexes, user)
 
-    return make_scim_response(user, 201)
+    return make_scim_response(get_user_representation(user), 201)
 
 
+@app.route('/scim/v2/Users/<int:user_id>', methods=['DELETE'])
 @app.route('/scim/v2/users/<int:user_id>', methods=['DELETE'])
 def delete_user(user_id):
 
     user = find_user(user_id)
-    users.remove(user[0])
+    with profiling.phase('mutate'):
+        users.remove(user[0])
+        indexes.remove(user_indexes, user[0])
+        remove_from_groups(memberships.user_node(user_id))
 
     return make_scim_response({}, 204)
 
 
+@app.route('/scim/v2/Users/<int:user_id>', methods=['GET'])
 @app.route('/scim/v2/users/<int:user_id>', methods=['GET'])
 def get_user(user_id):
 
     user = find_user(user_id)
 
-    return make_scim_response(user[0], 200)
+    return make_scim_response(get_user_representation(user[0]), 200)
 
 
+@app.route('/scim/v2/Users', methods=['GET'])
 @app.route('/scim/v2/users', methods=['GET'])
 def list_users():
 
     startIndex = int(request.args.get('startIndex', 1)) - 1 # make zero based
-    count = int(request.args.get('count', 10))
+    count = min(int(request.args.get('count', 10)), MAX_RESULTS)
     filter = request.args.get('filter')
 
     filtered = get_filtered_users(filter)
@@ -104,56 +128,81 @@ def list_users():
     return make_scim_response(response, 200)
 
 
+@app.route('/scim/v2/Users/<int:user_id>', methods=['PUT'])
 @app.route('/scim/v2/users/<int:user_id>', methods=['PUT'])
 def update_user(user_id):
     user = find_user(user_id)
+    payload = validate_payload('User')
 
-    if not request.json or not 'userName' in request.json:
-        scim_abort(400, 'userName is missing')
-
-    user[0]['userName'] = request.json.get('userName', user[0]['userName'])
-    user[0]['active'] = request.json.get('active', user[0]['active'])
-    user[0]['meta']['modified'] = get_current_datetime()
-
-    return make_scim_response(user[0], 200)
-
+    with profiling.phase('lookup'):
+        alreadyExists = [u for u in indexes.lookup(user_indexes, 'userName', payload['userName']) if u['id'] != user_id]
+    if alreadyExists:
+        scim_abort(409, 'user already exists')
 
+    # PUT replaces the resource, only the server assigned attributes survive
+    with profiling.phase('mutate'):
+        meta = user[0]['meta']
+        indexes.remove(user_indexes, user[0])
+        user[0].clear()
+        user[0].update({
+            'id': user_id,
+            'externalId': "",
+            'active': True
+        })
+        user[0].update(payload)
+        user[0]['meta'] = meta
+        indexes.add(user_indexes, user[0])
+        meta['modified'] = get_current_datetime()
+        meta['version'] = get_version(meta['created'], meta['modified'])
+
+    return make_scim_response(get_user_representation(user[0]), 200)
+
+
+@app.route('/scim/v2/Groups', methods=['POST'])
 @app.route('/scim/v2/groups', methods=['POST'])
 def create_group():
     id = groups[-1]['id'] + 1 if len(groups) > 0 else 0
-    if not request.json or not 'displayName' in request.json:
-        scim_abort(400, 'displayName is missing')
+    payload = validate_payload('Group')
 
-    alreadyExists = next((g for g in groups if g['displayName'] == request.json['displayName']), None)
+    with profiling.phase('lookup'):
+        alreadyExists = indexes.lookup(group_indexes, 'displayName', payload['displayName'])
     if alreadyExists:
         scim_abort(409, 'group already exists')
 
-    now = get_current_datetime()
-    group = {
-        'id': id,
-        'displayName': request.json['displayName'],
-        'schemas': ['urn:ietf:params:scim:schemas:core:2.0:Group'],
-        'externalId': request.json.get('externalId', ""),
-        'metadata': {
-            'resourceType': 'Group'
-            # TODO: add other attributes
-        },
-        'members': [],
-        'version': get_version(now, now)
-    }
-    groups.append(group)
-    return jsonify(group), 201
+    with profiling.phase('mutate'):
+        payload['members'] = set_members(id, payload.get('members', []))
+        now = get_current_datetime()
+        group = {
+            'id': id,
+            'externalId': ""
+        }
+        group.update(payload)
+        group['meta'] = {
+            'resourceType': 'Group',
+            'created': now,
+            'modified': now,
+            'location': get_location('/scim/v2/groups', id),
+            'version': get_version(now, now)
+        }
+        groups.append(group)
+        indexes.add(group_indexes, group)
+    return make_scim_response(group, 201)
 
 
+@app.route('/scim/v2/Groups/<int:group_id>', methods=['DELETE'])
 @app.route('/scim/v2/groups/<int:group_id>', methods=['DELETE'])
 def delete_group(group_id):
 
     group = find_group(group_id)
-    groups.remove(group[0])
+    with profiling.phase('mutate'):
+        groups.remove(group[0])
+        indexes.remove(group_indexes, group[0])
+        remove_from_groups(memberships.group_node(group_id))
 
     return make_scim_response({}, 204)
 
 
+@app.route('/scim/v2/Groups/<int:group_id>', methods=['GET'])
 @app.route('/scim/v2/groups/<int:group_id>', methods=['GET'])
 def get_group(group_id):
 
@@ -162,11 +211,12 @@ def get_group(group_id):
     return make_scim_response(group[0], 200)
 
 
+@app.route('/scim/v2/Groups', methods=['GET'])
 @app.route('/scim/v2/groups', methods=['GET'])
 def get_groups():
 
     startIndex = int(request.args.get('startIndex', 1)) - 1 # make zero based
-    count = int(request.args.get('count', 10))
+    count = min(int(request.args.get('count', 10)), MAX_RESULTS)
     filter = request.args.get('filter')
 
     filtered = get_filtered_groups(filter)
@@ -183,27 +233,58 @@ def get_groups():
     return make_scim_response(response, 200)
 
 
+@app.route('/scim/v2/Groups/<int:group_id>', methods=['PUT'])
 @app.route('/scim/v2/groups/<int:group_id>', methods=['PUT'])
 def update_group(group_id):
     group = find_group(group_id)
-    if not request.json or not 'displayName' in request.json:
-        scim_abort(400, 'displayName is missing')
+    payload = validate_payload('Group')
 
-    group[0]['displayName'] = request.json.get('displayName', group[0]['displayName'])
+    with profiling.phase('lookup'):
+        alreadyExists = [g for g in indexes.lookup(group_indexes, 'displayName', payload['displayName']) if g['id'] != group_id]
+    if alreadyExists:
+        scim_abort(409, 'group already exists')
+
+    # membership is managed through PATCH, so keep it when the payload leaves it out
+    with profiling.phase('mutate'):
+        meta = group[0]['meta']
+        members = group[0]['members']
+        if 'members' in payload:
+            members = set_members(group_id, payload['members'])
+            payload['members'] = members
+        indexes.remove(group_indexes, group[0])
+        group[0].clear()
+        group[0].update({
+            'id': group_id,
+            'externalId': "",
+            'members': members
+        })
+        group[0].update(payload)
+        group[0]['meta'] = meta
+        indexes.add(group_indexes, group[0])
+        meta['modified'] = get_current_datetime()
+        meta['version'] = get_version(meta['created'], meta['modified'])
 
     return make_scim_response(group[0], 200)
 
 
+@app.route('/scim/v2/Groups/<int:group_id>', methods=['PATCH'])
 @app.route('/scim/v2/groups/<int:group_id>', methods=['PATCH'])
 def change_group(group_id):
 
+    payload = request.get_json(silent=True)
+    if not isinstance(payload, dict) or not isinstance(payload.get('Operations'), list) or \
+            not all(isinstance(op, dict) for op in payload['Operations']):
+        scim_abort(400, 'Invalid syntax', 'invalidSyntax')
+
     try:
-        json = request.json
-        operations = json['Operations']
+        operations = payload['Operations']
 
+        [validate_patch(op, group_id) for op in operations]
         [patch(op, group_id) for op in operations]
         return make_scim_response(None, 204)
 
+    except schemas.SchemaError as ex:
+        scim_abort(400, ex.detail, ex.scim_type)
     except ValueError as ex:
         print(ex.args)
         scim_abort(400, 'unable to change membership', scim_type='invalidSyntax')
@@ -211,6 +292,138 @@ def change_group(group_id):
         return scim_abort(400, 'Invalid syntax', 'invalidSyntax')
 
 
+@app.route('/scim/v2/ServiceProviderConfig', methods=['GET'])
+@app.route('/scim/v2/serviceproviderconfig', methods=['GET'])
+def get_service_provider_config():
+
+    response = {
+        'schemas': ['urn:ietf:params:scim:schemas:core:2.0:ServiceProviderConfig'],
+        'patch': {'supported': True},
+        'bulk': {'supported': False, 'maxOperations': 0, 'maxPayloadSize': 0},
+        'filter': {'supported': True, 'maxResults': MAX_RESULTS},
+        'changePassword': {'supported': False},
+        'sort': {'supported': False},
+        'etag': {'supported': False},
+        'authenticationSchemes': [],
+        'meta': {
+            'resourceType': 'ServiceProviderConfig',
+            'location': '/scim/v2/ServiceProviderConfig'
+        }
+    }
+    return make_scim_response(response, 200)
+
+
+@app.route('/scim/v2/Schemas', methods=['GET'])
+@app.route('/scim/v2/schemas', methods=['GET'])
+def list_schemas():
+
+    resources = [get_schema_representation(s) for s in schemas.schemas.values()]
+    return make_scim_response(create_list_response(resources), 200)
+
+
+@app.route('/scim/v2/Schemas/<schema_id>', methods=['GET'])
+@app.route('/scim/v2/schemas/<schema_id>', methods=['GET'])
+def get_schema(schema_id):
+
+    schema = schemas.schemas.get(schema_id)
+    if not schema:
+        scim_abort(404, 'schema not found')
+
+    return make_scim_response(get_schema_representation(schema), 200)
+
+
+@app.route('/scim/v2/ResourceTypes', methods=['GET'])
+@app.route('/scim/v2/resourcetypes', methods=['GET'])
+def list_resource_types():
+
+    resources = [get_resource_type_representation(r) for r in schemas.resource_types.values()]
+    return make_scim_response(create_list_response(resources), 200)
+
+
+@app.route('/scim/v2/ResourceTypes/<name>', methods=['GET'])
+@app.route('/scim/v2/resourcetypes/<name>', methods=['GET'])
+def get_resource_type(name):
+
+    resource_type = schemas.resource_types.get(name)
+    if not resource_type:
+        scim_abort(404, 'resource type not found')
+
+    return make_scim_response(get_resource_type_representation(resource_type), 200)
+
+
+@app.route('/admin/profiling', methods=['GET'])
+def get_profiling():
+
+    return jsonify(profiling.settings), 200
+
+
+@app.route('/admin/profiling', methods=['PUT'])
+def update_profiling():
+    payload = request.get_json(silent=True)
+    if not isinstance(payload, dict):
+        scim_abort(400, 'profiling settings are missing', 'invalidSyntax')
+
+    for name in ['sampling', 'timing']:
+        if name in payload and not isinstance(payload[name], bool):
+            scim_abort(400, name + ' must be a boolean', 'invalidValue')
+    for name in ['interval', 'sampleRate']:
+        value = payload.get(name)
+        if value is not None and (isinstance(value, bool) or not isinstance(value, (int, float)) or not 0 < value <= 1):
+            scim_abort(400, name + ' must be a number between 0 and 1', 'invalidValue')
+
+    profiling.configure(
+        sampling=payload.get('sampling'),
+        timing=payload.get('timing'),
+        interval=payload.get('interval'),
+        sample_rate=payload.get('sampleRate'))
+
+    return jsonify(profiling.settings), 200
+
+
+@app.route('/admin/profiling/flamegraph', methods=['GET'])
+def get_flamegraph():
+
+    # collapsed stacks, one "frame;frame;frame count" line per stack, as consumed by flamegraph.pl or speedscope
+    return Response(profiling.get_collapsed_stacks(), 200, mimetype='text/plain')
+
+
+@app.route('/admin/profiling/flamegraph', methods=['DELETE'])
+def clear_flamegraph():
+
+    profiling.clear_stacks()
+    return Response(status=204)
+
+
+def get_schema_representation(schema):
+    representation = dict(schema)
+    representation['schemas'] = ['urn:ietf:params:scim:schemas:core:2.0:Schema']
+    representation['meta'] = {
+        'resourceType': 'Schema',
+        'location': '/scim/v2/Schemas/' + schema['id']
+    }
+    return representation
+
+
+def get_resource_type_representation(resource_type):
+    representation = dict(resource_type)
+    representation['meta'] = {
+        'resourceType': 'ResourceType',
+        'location': '/scim/v2/ResourceTypes/' + resource_type['id']
+    }
+    return representation
+
+
+def create_list_response(resources):
+    return {
+        'schemas': ['urn:ietf:params:scim:api:messages:2.0:ListResponse'],
+        'totalResults': len(resources),
+        'Resources': resources,
+        'startIndex': 1,
+        'itemsPerPage': len(resources)
+    }
+
+
+@profiling.timed('lookup')
 def find_user(user_id):
     user = [user for user in users if user['id'] == user_id]
     if len(user) == 0:
@@ -218,52 +431,161 @@ def find_user(user_id):
     return user
 
 
+@profiling.timed('lookup')
 def find_group(group_id):
-    group = [group for group in groups if group['id'] == group_id]
+    group = indexes.lookup(group_indexes, 'id', group_id)
     if len(group) == 0:
         scim_abort(404, 'group not found')
     return group
 
+def validate_patch(operation, group_id):
+    # runs for every operation before any of them is applied, so a rejected
+    # request leaves the group untouched
+    if operation['op'] == 'add' and operation['path'] == 'members':
+        values = schemas.validate_attribute('Group', 'members', operation['value'])
+        nodes = [get_member_node(create_member(val)) for val in values if 'value' in val]
+        if any(memberships.creates_cycle(membership_graph, group_id, n) for n in nodes):
+            scim_abort(400, 'unable to change membership', 'invalidValue')
+        operation['value'] = values
+
+
 def patch(operation, group_id):
 
     if operation['op'] == 'add' and operation['path'] == 'members':
-        [add_user(val, group_id) for val in operation['value']]
+        [add_member(val, group_id) for val in operation['value'] if 'value' in val]
     elif operation['op'] == 'remove' and operation['path'].startswith('members'):
         # looks like: "path": 'members[value eq \"id\"]'
         name, val = get_member_to_remove(operation['path'])
         if name == 'value':
-            remove_user(val, group_id)
+            remove_member(val, group_id)
 
     return operation
 
 
-def add_user(value, group_id):
-    print('adding user ' + value['value'] + ' to group ' + str(group_id))
+@profiling.timed('mutate')
+def add_member(value, group_id):
+    print('adding member ' + value['value'] + ' to group ' + str(group_id))
 
     group = find_group(group_id)
 
-    user = {'id':value['value'], '$ref': '/scim/v2/users/' + value['value']}
-    group[0]['members'].append(user)
+    member = create_member(value)
+    node = get_member_node(member)
+    if node in memberships.get_children(membership_graph, group_id):
+        return
+
+    memberships.add_member(membership_graph, group_id, node)
+    group[0]['members'].append(member)
 
 
-def remove_user(value, group_id):
-    print('removing user ' + value + ' from group ' + str(group_id))
+@profiling.timed('mutate')
+def remove_member(value, group_id):
+    print('removing member ' + value + ' from group ' + str(group_id))
     group = find_group(group_id)
-    group[0]['members'] = [m for m in group[0]['members'] if m['id'] != str(group_id)]
 
+    for member in group[0]['members']:
+        if member['value'] == value:
+            memberships.remove_member(membership_graph, group_id, get_member_node(member))
+    group[0]['members'] = [m for m in group[0]['members'] if m['value'] != value]
+
+
+def set_members(group_id, values):
+    # replaces the membership of a group, members without a value are dropped
+    # and repeated members are only kept once
+    members = [create_member(m) for m in values if 'value' in m]
+    members = list({get_member_node(m): m for m in members}.values())
+    nodes = [get_member_node(m) for m in members]
+    if any(memberships.creates_cycle(membership_graph, group_id, n) for n in nodes):
+        scim_abort(400, 'unable to change membership', 'invalidValue')
+
+    for node in list(memberships.get_children(membership_graph, group_id)):
+        memberships.remove_member(membership_graph, group_id, node)
+    for node in nodes:
+        memberships.add_member(membership_graph, group_id, node)
+    return members
+
+
+def remove_from_groups(node):
+    for parent_id in memberships.get_parents(membership_graph, node):
+        group = indexes.lookup(group_indexes, 'id', int(parent_id))
+        for g in group:
+            g['members'] = [m for m in g['members'] if get_member_node(m) != node]
+    memberships.remove_node(membership_graph, node)
+
+
+def create_member(value):
+    member_type = 'Group' if value.get('type', '').lower() == 'group' else 'User'
+    prefix = '/scim/v2/groups' if member_type == 'Group' else '/scim/v2/users'
+    member = {
+        'value': value['value'],
+        '$ref': get_location(prefix, value['value']),
+        'type': member_type
+    }
+    if 'display' in value:
+        member['display'] = value['display']
+    return member
+
+
+def get_member_node(member):
+    if member['type'] == 'Group':
+        return memberships.group_node(member['value'])
+    return memberships.user_node(member['value'])
+
+
+@profiling.timed('serialize')
+def get_user_representation(user):
+    representation = dict(schemas.serialize('User', user))
+
+    with profiling.phase('lookup'):
+        node = memberships.user_node(user['id'])
+        ancestors = memberships.get_ancestors(membership_graph, node)
+        direct = memberships.get_parents(membership_graph, node)
+        member_of = [group for group_id in sorted(ancestors, key=int) for group in indexes.lookup(group_indexes, 'id', int(group_id))]
 
+    if member_of:
+        representation['groups'] = [{
+            'value': str(group['id']),
+            '$ref': group['meta']['location'],
+            'display': group['displayName'],
+            'type': 'direct' if str(group['id']) in direct else 'indirect'
+        } for group in member_of]
+
+    return representation
+
+
+@profiling.timed('parse')
 def get_member_to_remove(exp):
 
     if exp:
-        m = re.match(r"^members\[(\w+)\s+eq\s+[\"'](\w+)[\"']\]$", exp)
+        m = re.match(r"^members\[(.*)\]$", exp.strip())
         if m:
-            attribute_name = m.groups()[0]
-            attribute_value = m.groups()[1]
-            return attribute_name, attribute_value
+            return parse_equality_filter(m.groups()[0])
 
     raise ValueError('Invalid expression')
 
 
+def parse_equality_filter(exp):
+    # values are JSON strings, but single quoted values are accepted too
+    m = re.match(r'''^\s*(\w+(?:\.\w+)?)\s+eq\s+("(?:[^"\\]|\\.)*"|'[^']*')\s*$''', exp, re.IGNORECASE)
+    if not m:
+        raise ValueError('Invalid expression')
+
+    attribute_name, attribute_value = m.groups()
+    if attribute_value.startswith('"'):
+        attribute_value = json.loads(attribute_value)
+    else:
+        attribute_value = attribute_value[1:-1]
+    return attribute_name, attribute_value
+
+
+@profiling.timed('parse')
+def validate_payload(resource_type):
+    try:
+        return schemas.validate(resource_type, request.get_json(silent=True))
+    except schemas.SchemaError as ex:
+        scim_abort(400, ex.detail, ex.scim_type)
+
+
+@profiling.timed('serialize')
 def make_scim_response(data, code):
     resp = make_response(jsonify(data))
     resp.headers['Content-Type'] = 'application/scim+json'
@@ -287,38 +609,60 @@ def create_error_payload(status, detail, scim_type=None):
     return data
 
 
+@profiling.timed('lookup')
 def get_filtered_users(filter_exp):
 
     if filter_exp:
-        m = re.match(r"^(\w+)\s+eq\s+[\"'](\w+)[\"']$", filter_exp)
-        if m:
-            attributeName = m.groups()[0]
-            attributeValue = m.groups()[1]
+        attributeName, attributeValue = parse_filter(filter_exp)
+        attributeName = next((a for a in user_indexes if a.lower() == attributeName.lower()), None)
 
-            if attributeName not in ['userName', 'externalId']:
-                scim_abort(400, 'only userName and externalId supported in filter', 'invalid_filter')
+        if not attributeName:
+            scim_abort(400, 'only userName and externalId supported in filter', 'invalid_filter')
 
-            return [u for u in users if u[attributeName] == attributeValue]
+        return sorted(indexes.lookup(user_indexes, attributeName, attributeValue), key=lambda u: u['id'])
 
     return users
 
 
+@profiling.timed('lookup')
 def get_filtered_groups(filter_exp):
 
     if filter_exp:
-        m = re.match(r"^(\w+)\s+eq\s+[\"'](\w+)[\"']$", filter_exp)
+        m = re.match(r"^\s*members\[(.*)\]\s*$", filter_exp, re.IGNORECASE)
         if m:
-            attributeName = m.groups()[0]
-            attributeValue = m.groups()[1]
+            attributeName, attributeValue = parse_filter(m.groups()[0])
+            attributeName = 'members.' + attributeName
+        else:
+            attributeName, attributeValue = parse_filter(filter_exp)
+
+        if attributeName.lower() in ['members', 'members.value']:
+            return get_groups_with_member(attributeValue)
+
+        attributeName = next((a for a in ['displayName', 'externalId'] if a.lower() == attributeName.lower()), None)
 
-            if attributeName not in ['displayName', 'externalId']:
-                scim_abort(400, 'only displayName and externalId supported in filter', 'invalid_filter')
+        if not attributeName:
+            scim_abort(400, 'only displayName, externalId and members supported in filter', 'invalid_filter')
 
-            return [g for g in groups if g[attributeName] == attributeValue]
+        return sorted(indexes.lookup(group_indexes, attributeName, attributeValue), key=lambda g: g['id'])
 
     return groups
 
 
+def get_groups_with_member(value):
+    # member values do not say whether they refer to a user or a group
+    parents = memberships.get_parents(membership_graph, memberships.user_node(value)) | \
+        memberships.get_parents(membership_graph, memberships.group_node(value))
+    return sorted((g for group_id in parents for g in indexes.lookup(group_indexes, 'id', int(group_id))), key=lambda g: g['id'])
+
+
+@profiling.timed('parse')
+def parse_filter(filter_exp):
+    try:
+        return parse_equality_filter(filter_exp)
+    except ValueError:
+        scim_abort(400, 'only eq filters on a single attribute are supported', 'invalid_filter')
+
+
 def get_current_datetime():
     d = datetime.datetime.utcnow()
     return d.isoformat("T") + "Z"
@@ -332,7 +676,7 @@ def get_version(created, modified):
 
 
 def get_location(prefix, id):
-    return urllib.parse.urljoin(prefix, str(id))
+    return urllib.parse.urljoin(prefix + '/', urllib.parse.quote(str(id)))
 
 
 if __name__ == '__main__':
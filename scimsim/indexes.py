@@ -0,0 +1,53 @@
+import unicodedata
+from . import schemas
+
+
+def normalize(value, case_exact):
+    if not isinstance(value, str):
+        return value
+    if case_exact:
+        return unicodedata.normalize('NFC', value)
+    return unicodedata.normalize('NFKC', unicodedata.normalize('NFKC', value).casefold())
+
+
+def create_indexes(resource_type_name, attribute_names):
+    # keys are stored normalized according to the caseExact setting of the attribute
+    # so lookups never have to normalize the stored values again
+    return {
+        name: {
+            'caseExact': schemas.get_attribute(resource_type_name, name)['caseExact'],
+            'entries': {}
+        } for name in attribute_names
+    }
+
+
+def add(indexes, resource):
+    for name, index in indexes.items():
+        value = resource.get(name)
+        if value is not None and value != '':
+            key = normalize(value, index['caseExact'])
+            index['entries'].setdefault(key, {})[resource['id']] = resource
+
+
+def remove(indexes, resource):
+    for name, index in indexes.items():
+        value = resource.get(name)
+        if value is not None and value != '':
+            key = normalize(value, index['caseExact'])
+            entries = index['entries'].get(key)
+            if entries is not None:
+                entries.pop(resource['id'], None)
+                if not entries:
+                    del index['entries'][key]
+
+
+def lookup(indexes, attribute_name, value):
+    # resources sharing a key are kept by id, so removing one never scans the others
+    index = indexes[attribute_name]
+    entries = index['entries'].get(normalize(value, index['caseExact']))
+    return list(entries.values()) if entries else []
+
+
+def clear(indexes):
+    for index in indexes.values():
+        index['entries'].clear()
@@ -0,0 +1,124 @@
+def user_node(id):
+    return ('User', str(id))
+
+
+def group_node(id):
+    return ('Group', str(id))
+
+
+def create_graph():
+    return {
+        'parents': {},      # node -> ids of the groups it is a direct member of
+        'children': {},     # group id -> nodes that are direct members of the group
+        'ancestors': {}     # node -> ids of all groups it is a member of, filled on demand
+    }
+
+
+def get_parents(graph, node):
+    return graph['parents'].get(node, frozenset())
+
+
+def get_children(graph, group_id):
+    return graph['children'].get(str(group_id), frozenset())
+
+
+def get_ancestors(graph, node):
+    cache = graph['ancestors']
+    ancestors = cache.get(node)
+    if ancestors is not None:
+        return ancestors
+
+    # walk up with an explicit stack instead of recursing, so deep hierarchies
+    # cannot exhaust the interpreter stack; a node is resolved once all of its
+    # parents are in the cache
+    parents = graph['parents']
+    stack = [node]
+    while stack:
+        current = stack[-1]
+        if current in cache:
+            stack.pop()
+            continue
+
+        pending = [group_node(p) for p in parents.get(current, ()) if group_node(p) not in cache]
+        if pending:
+            stack.extend(pending)
+            continue
+
+        ancestors = set()
+        for group_id in parents.get(current, ()):
+            ancestors.add(group_id)
+            ancestors |= cache[group_node(group_id)]
+        cache[current] = frozenset(ancestors)
+        stack.pop()
+
+    return cache[node]
+
+
+def get_descendants(graph, node):
+    descendants = [node]
+    seen = {node}
+    for current in descendants:
+        if current[0] != 'Group':
+            continue
+        for child in graph['children'].get(current[1], ()):
+            if child not in seen:
+                seen.add(child)
+                descendants.append(child)
+    return descendants
+
+
+def creates_cycle(graph, group_id, node):
+    group_id = str(group_id)
+    return node == group_node(group_id) or (node[0] == 'Group' and node[1] in get_ancestors(graph, group_node(group_id)))
+
+
+def add_member(graph, group_id, node):
+    group_id = str(group_id)
+    children = graph['children'].setdefault(group_id, set())
+    if node in children:
+        return
+    if creates_cycle(graph, group_id, node):
+        raise ValueError('membership would create a cycle')
+
+    children.add(node)
+    graph['parents'].setdefault(node, set()).add(group_id)
+
+    # everything below the new member gains the group and its ancestors, so extend
+    # the cached closures in place instead of dropping them
+    added = {group_id} | get_ancestors(graph, group_node(group_id))
+    cache = graph['ancestors']
+    for descendant in get_descendants(graph, node):
+        if descendant in cache:
+            cache[descendant] = cache[descendant] | added
+
+
+def remove_member(graph, group_id, node):
+    group_id = str(group_id)
+    children = graph['children'].get(group_id)
+    if not children or node not in children:
+        return
+
+    children.discard(node)
+    graph['parents'][node].discard(group_id)
+
+    # other paths may still lead to the same ancestors, so only drop the closures
+    # below the removed edge and let them be recomputed on demand
+    cache = graph['ancestors']
+    for descendant in get_descendants(graph, node):
+        cache.pop(descendant, None)
+
+
+def remove_node(graph, node):
+    for group_id in list(graph['parents'].get(node, ())):
+        remove_member(graph, group_id, node)
+    if node[0] == 'Group':
+        for child in list(graph['children'].get(node[1], ())):
+            remove_member(graph, node[1], child)
+        graph['children'].pop(node[1], None)
+    graph['parents'].pop(node, None)
+    graph['ancestors'].pop(node, None)
+
+
+def clear(graph):
+    for value in graph.values():
+        value.clear()
@@ -0,0 +1,167 @@
+import collections
+import contextlib
+import functools
+import os
+import random
+import sys
+import threading
+import time
+from flask import g
+
+# both are off unless enabled at startup through SCIMSIM_PROFILING=sampling,timing
+# or at runtime through the admin endpoint
+settings = {
+    'sampling': False,
+    'timing': False,
+    'interval': 0.005,
+    'sampleRate': 1.0
+}
+
+stacks = collections.Counter()
+active_requests = {}
+lock = threading.Lock()
+sampler = {'thread': None, 'stop': None}
+
+
+def configure(sampling=None, timing=None, interval=None, sample_rate=None):
+    if interval is not None:
+        settings['interval'] = interval
+    if sample_rate is not None:
+        settings['sampleRate'] = sample_rate
+    if timing is not None:
+        settings['timing'] = timing
+    if sampling is not None:
+        settings['sampling'] = sampling
+        if sampling:
+            start_sampler()
+        else:
+            stop_sampler()
+
+
+def start_sampler():
+    if sampler['thread'] and sampler['thread'].is_alive():
+        return
+    stop = threading.Event()
+    thread = threading.Thread(target=sample_loop, args=(stop,), name='scimsim-sampler', daemon=True)
+    sampler['thread'], sampler['stop'] = thread, stop
+    thread.start()
+
+
+def stop_sampler():
+    if sampler['stop']:
+        sampler['stop'].set()
+    sampler['thread'], sampler['stop'] = None, None
+    with lock:
+        active_requests.clear()
+
+
+def sample_loop(stop):
+    while not stop.wait(settings['interval']):
+        with lock:
+            if not active_requests:
+                continue
+            frames = sys._current_frames()
+            for thread_id, label in active_requests.items():
+                frame = frames.get(thread_id)
+                if frame is not None:
+                    stacks[collapse_stack(frame, label)] += 1
+
+
+def collapse_stack(frame, label):
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        names.append('{} ({}:{})'.format(code.co_name, os.path.basename(code.co_filename), code.co_firstlineno))
+        frame = frame.f_back
+    names.append(label)
+    return ';'.join(reversed(names))
+
+
+def get_collapsed_stacks():
+    with lock:
+        return ''.join('{} {}\n'.format(stack, count) for stack, count in stacks.most_common())
+
+
+def clear_stacks():
+    with lock:
+        stacks.clear()
+
+
+def start_request(label):
+    g.profiling_timings = None
+    if settings['timing']:
+        g.profiling_start = time.perf_counter()
+        g.profiling_timings = collections.OrderedDict()
+        g.profiling_phases = []
+
+    if settings['sampling'] and random.random() < settings['sampleRate']:
+        with lock:
+            active_requests[threading.get_ident()] = label
+
+
+def end_request():
+    if settings['sampling']:
+        with lock:
+            active_requests.pop(threading.get_ident(), None)
+
+
+no_phase = contextlib.nullcontext()
+
+
+def phase(name):
+    if not settings['timing']:
+        return no_phase
+    return timed_phase(name)
+
+
+@contextlib.contextmanager
+def timed_phase(name):
+    # timing may have been switched on halfway through a request
+    timings = g.get('profiling_timings')
+    if timings is None:
+        yield
+        return
+
+    # phases nest (a lookup while mutating), so pause the outer phase to keep
+    # each duration exclusive
+    phases = g.profiling_phases
+    now = time.perf_counter()
+    if phases:
+        outer, started = phases[-1]
+        timings[outer] = timings.get(outer, 0.0) + now - started
+    phases.append((name, now))
+    try:
+        yield
+    finally:
+        now = time.perf_counter()
+        name, started = phases.pop()
+        timings[name] = timings.get(name, 0.0) + now - started
+        if phases:
+            phases[-1] = (phases[-1][0], now)
+
+
+def timed(name):
+    def decorator(f):
+        @functools.wraps(f)
+        def wrapper(*args, **kwargs):
+            if not settings['timing']:
+                return f(*args, **kwargs)
+            with timed_phase(name):
+                return f(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def add_server_timing(response):
+    timings = g.get('profiling_timings')
+    if timings is None:
+        return response
+
+    entries = ['{};dur={:.3f}'.format(name, duration * 1000) for name, duration in timings.items()]
+    entries.append('total;dur={:.3f}'.format((time.perf_counter() - g.profiling_start) * 1000))
+    response.headers['Server-Timing'] = ', '.join(entries)
+    return response
+
+
+enabled = os.environ.get('SCIMSIM_PROFILING', '').split(',')
+configure(sampling='sampling' in enabled or None, timing='timing' in enabled or None)
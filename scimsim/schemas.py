@@ -0,0 +1,349 @@
+import datetime
+
+USER_SCHEMA_ID = 'urn:ietf:params:scim:schemas:core:2.0:User'
+GROUP_SCHEMA_ID = 'urn:ietf:params:scim:schemas:core:2.0:Group'
+ENTERPRISE_USER_SCHEMA_ID = 'urn:ietf:params:scim:schemas:extension:enterprise:2.0:User'
+
+
+class SchemaError(ValueError):
+
+    def __init__(self, detail, scim_type='invalidValue'):
+        super().__init__(detail)
+        self.detail = detail
+        self.scim_type = scim_type
+
+
+def attribute(name, type='string', multi_valued=False, required=False, case_exact=False,
+              mutability='readWrite', returned='default', uniqueness='none',
+              sub_attributes=None, canonical_values=None, reference_types=None, description=''):
+    attr = {
+        'name': name,
+        'type': type,
+        'multiValued': multi_valued,
+        'description': description,
+        'required': required,
+        'caseExact': case_exact,
+        'mutability': mutability,
+        'returned': returned,
+        'uniqueness': uniqueness
+    }
+    if sub_attributes is not None:
+        attr['subAttributes'] = sub_attributes
+    if canonical_values is not None:
+        attr['canonicalValues'] = canonical_values
+    if reference_types is not None:
+        attr['referenceTypes'] = reference_types
+    return attr
+
+
+def multi_valued_attribute(name, value_type='string', types=None, mutability='readWrite', reference_types=None):
+    return attribute(name, 'complex', multi_valued=True, mutability=mutability, sub_attributes=[
+        attribute('value', value_type, mutability=mutability, reference_types=reference_types),
+        attribute('display', mutability=mutability),
+        attribute('type', mutability=mutability, canonical_values=types),
+        attribute('primary', 'boolean', mutability=mutability)
+    ])
+
+
+USER_SCHEMA = {
+    'id': USER_SCHEMA_ID,
+    'name': 'User',
+    'description': 'User Account',
+    'attributes': [
+        attribute('userName', required=True, uniqueness='server'),
+        attribute('name', 'complex', sub_attributes=[
+            attribute('formatted'),
+            attribute('familyName'),
+            attribute('givenName'),
+            attribute('middleName'),
+            attribute('honorificPrefix'),
+            attribute('honorificSuffix')
+        ]),
+        attribute('displayName'),
+        attribute('nickName'),
+        attribute('profileUrl', 'reference', reference_types=['external']),
+        attribute('title'),
+        attribute('userType'),
+        attribute('preferredLanguage'),
+        attribute('locale'),
+        attribute('timezone'),
+        attribute('active', 'boolean'),
+        attribute('password', mutability='writeOnly', returned='never'),
+        multi_valued_attribute('emails', types=['work', 'home', 'other']),
+        multi_valued_attribute('phoneNumbers', types=['work', 'home', 'mobile', 'fax', 'pager', 'other']),
+        multi_valued_attribute('ims', types=['aim', 'gtalk', 'icq', 'xmpp', 'msn', 'skype', 'qq', 'yahoo']),
+        multi_valued_attribute('photos', 'reference', types=['photo', 'thumbnail'], reference_types=['external']),
+        attribute('addresses', 'complex', multi_valued=True, sub_attributes=[
+            attribute('formatted'),
+            attribute('streetAddress'),
+            attribute('locality'),
+            attribute('region'),
+            attribute('postalCode'),
+            attribute('country'),
+            attribute('type', canonical_values=['work', 'home', 'other']),
+            attribute('primary', 'boolean')
+        ]),
+        attribute('groups', 'complex', multi_valued=True, mutability='readOnly', sub_attributes=[
+            attribute('value', mutability='readOnly'),
+            attribute('$ref', 'reference', mutability='readOnly', reference_types=['User', 'Group']),
+            attribute('display', mutability='readOnly'),
+            attribute('type', mutability='readOnly', canonical_values=['direct', 'indirect'])
+        ]),
+        multi_valued_attribute('entitlements'),
+        multi_valued_attribute('roles'),
+        multi_valued_attribute('x509Certificates', 'binary')
+    ]
+}
+
+GROUP_SCHEMA = {
+    'id': GROUP_SCHEMA_ID,
+    'name': 'Group',
+    'description': 'Group',
+    'attributes': [
+        attribute('displayName', required=True),
+        attribute('members', 'complex', multi_valued=True, sub_attributes=[
+            attribute('value', mutability='immutable'),
+            attribute('$ref', 'reference', mutability='immutable', reference_types=['User', 'Group']),
+            attribute('display', mutability='immutable'),
+            attribute('type', mutability='immutable', canonical_values=['User', 'Group'])
+        ])
+    ]
+}
+
+ENTERPRISE_USER_SCHEMA = {
+    'id': ENTERPRISE_USER_SCHEMA_ID,
+    'name': 'EnterpriseUser',
+    'description': 'Enterprise User',
+    'attributes': [
+        attribute('employeeNumber'),
+        attribute('costCenter'),
+        attribute('organization'),
+        attribute('division'),
+        attribute('department'),
+        attribute('manager', 'complex', sub_attributes=[
+            attribute('value'),
+            attribute('$ref', 'reference', reference_types=['User']),
+            attribute('displayName', mutability='readOnly')
+        ])
+    ]
+}
+
+# attributes every resource carries in addition to the ones defined by its schemas
+COMMON_ATTRIBUTES = [
+    attribute('id', case_exact=True, mutability='readOnly', returned='always', uniqueness='server'),
+    attribute('externalId', case_exact=True)
+]
+
+schemas = {
+    USER_SCHEMA_ID: USER_SCHEMA,
+    GROUP_SCHEMA_ID: GROUP_SCHEMA,
+    ENTERPRISE_USER_SCHEMA_ID: ENTERPRISE_USER_SCHEMA
+}
+
+resource_types = {
+    'User': {
+        'schemas': ['urn:ietf:params:scim:schemas:core:2.0:ResourceType'],
+        'id': 'User',
+        'name': 'User',
+        'endpoint': '/Users',
+        'description': 'User Account',
+        'schema': USER_SCHEMA_ID,
+        'schemaExtensions': [
+            {'schema': ENTERPRISE_USER_SCHEMA_ID, 'required': False}
+        ]
+    },
+    'Group': {
+        'schemas': ['urn:ietf:params:scim:schemas:core:2.0:ResourceType'],
+        'id': 'Group',
+        'name': 'Group',
+        'endpoint': '/Groups',
+        'description': 'Group',
+        'schema': GROUP_SCHEMA_ID,
+        'schemaExtensions': []
+    }
+}
+
+validators = {}
+serializers = {}
+attribute_validators = {}
+
+
+def is_string(value):
+    return isinstance(value, str)
+
+
+def is_boolean(value):
+    return isinstance(value, bool)
+
+
+def is_integer(value):
+    return isinstance(value, int) and not isinstance(value, bool)
+
+
+def is_decimal(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def is_datetime(value):
+    if not isinstance(value, str):
+        return False
+    try:
+        datetime.datetime.fromisoformat(value.replace('Z', '+00:00'))
+    except ValueError:
+        return False
+    return True
+
+
+type_checks = {
+    'string': (is_string, 'a string'),
+    'reference': (is_string, 'a reference'),
+    'binary': (is_string, 'a base64 encoded string'),
+    'boolean': (is_boolean, 'a boolean'),
+    'integer': (is_integer, 'an integer'),
+    'decimal': (is_decimal, 'a decimal'),
+    'dateTime': (is_datetime, 'a dateTime')
+}
+
+
+def compile_value(attr, path):
+    if attr['type'] == 'complex':
+        normalize_complex = compile_attributes(attr.get('subAttributes', []), path + '.')
+
+        def normalize_value(value):
+            if not isinstance(value, dict):
+                raise SchemaError('{} must be a complex value'.format(path))
+            return normalize_complex(value)
+
+        return normalize_value
+
+    check, description = type_checks[attr['type']]
+    message = '{} must be {}'.format(path, description)
+
+    def normalize_value(value):
+        if not check(value):
+            raise SchemaError(message)
+        return value
+
+    return normalize_value
+
+
+def compile_attribute(attr, path):
+    normalize_value = compile_value(attr, path)
+    if not attr['multiValued']:
+        return normalize_value
+
+    message = '{} must be multi-valued'.format(path)
+
+    def normalize_values(values):
+        if not isinstance(values, list):
+            raise SchemaError(message)
+        return [normalize_value(value) for value in values if value is not None]
+
+    return normalize_values
+
+
+def compile_attributes(attrs, prefix=''):
+    # attribute names are case insensitive, so look them up by their lowercased name
+    # and store them under the name the schema defines
+    writable = {a['name'].lower(): (a['name'], compile_attribute(a, prefix + a['name']))
+                for a in attrs if a['mutability'] != 'readOnly'}
+    required = [(a['name'], '{}{} is missing'.format(prefix, a['name'])) for a in attrs if a['required']]
+
+    def normalize(payload):
+        result = {}
+        for key, value in payload.items():
+            entry = writable.get(key.lower())
+            if entry is None or value is None:
+                continue
+            name, normalize_attribute = entry
+            result[name] = normalize_attribute(value)
+        for name, message in required:
+            if name not in result:
+                raise SchemaError(message)
+        return result
+
+    return normalize
+
+
+def compile_resource_type(resource_type):
+    schema_id = resource_type['schema']
+    normalize_core = compile_attributes(schemas[schema_id]['attributes'] + COMMON_ATTRIBUTES)
+    extensions = [(ext['schema'], ext['required'], compile_attributes(schemas[ext['schema']]['attributes'], ext['schema'] + ':'))
+                  for ext in resource_type['schemaExtensions']]
+
+    def validate(payload):
+        if not isinstance(payload, dict):
+            payload = {}
+
+        resource = normalize_core(payload)
+        resource_schemas = [schema_id]
+        for urn, required, normalize_extension in extensions:
+            value = payload.get(urn)
+            if value is None:
+                if required:
+                    raise SchemaError('{} is missing'.format(urn))
+                continue
+            if not isinstance(value, dict):
+                raise SchemaError('{} must be a complex value'.format(urn))
+            resource[urn] = normalize_extension(value)
+            resource_schemas.append(urn)
+
+        resource['schemas'] = resource_schemas
+        return resource
+
+    hidden = {a['name'] for a in schemas[schema_id]['attributes'] if a['returned'] == 'never'}
+
+    def serialize(resource):
+        if hidden.isdisjoint(resource):
+            return resource
+        return {k: v for k, v in resource.items() if k not in hidden}
+
+    return validate, serialize
+
+
+def compile_resource_types():
+    for name, resource_type in resource_types.items():
+        validators[name], serializers[name] = compile_resource_type(resource_type)
+
+
+def add_schema_extension(resource_type_name, schema, required=False):
+    schemas[schema['id']] = schema
+    resource_type = resource_types[resource_type_name]
+    resource_type['schemaExtensions'] = [ext for ext in resource_type['schemaExtensions'] if ext['schema'] != schema['id']]
+    resource_type['schemaExtensions'].append({'schema': schema['id'], 'required': required})
+    validators[resource_type_name], serializers[resource_type_name] = compile_resource_type(resource_type)
+
+
+def remove_schema_extension(resource_type_name, schema_id):
+    resource_type = resource_types[resource_type_name]
+    resource_type['schemaExtensions'] = [ext for ext in resource_type['schemaExtensions'] if ext['schema'] != schema_id]
+    if not any(ext['schema'] == schema_id for r in resource_types.values() for ext in r['schemaExtensions']):
+        schemas.pop(schema_id, None)
+    validators[resource_type_name], serializers[resource_type_name] = compile_resource_type(resource_type)
+
+
+def get_attribute(resource_type_name, attribute_name):
+    schema_id = resource_types[resource_type_name]['schema']
+    name = attribute_name.lower()
+    return next((a for a in schemas[schema_id]['attributes'] + COMMON_ATTRIBUTES if a['name'].lower() == name), None)
+
+
+def validate_attribute(resource_type_name, attribute_name, value):
+    key = (resource_type_name, attribute_name)
+    validate_value = attribute_validators.get(key)
+    if validate_value is None:
+        attr = get_attribute(resource_type_name, attribute_name)
+        validate_value = compile_attribute(attr, attr['name'])
+        attribute_validators[key] = validate_value
+    return validate_value(value)
+
+
+def validate(resource_type_name, payload):
+    return validators[resource_type_name](payload)
+
+
+def serialize(resource_type_name, resource):
+    return serializers[resource_type_name](resource)
+
+
+compile_resource_types()
@@ -1,6 +1,8 @@
 from dateutil.parser import parse
+import flask
 import json
 import pytest
+import time
 import scimsim
 
 @pytest.fixture
@@ -122,6 +124,93 @@ def test_list_users_with_username_filter(client):
     assert "urn:ietf:params:scim:api:messages:2.0:ListResponse" in response.json["schemas"]
 
 
+def test_list_users_with_case_insensitive_username_filter(client):
+    """
+        Check that GET /Users?filter=userName eq "..." matches userName case insensitively
+    """
+    client.post('/scim/v2/users', data=json.dumps({'userName': 'Marcel.vdDungen@Example.com'}), content_type='application/json')
+    client.post('/scim/v2/users', data=json.dumps({'userName': 'STRASSE'}), content_type='application/json')
+
+    response = client.get('/scim/v2/users?filter=username EQ "marcel.vddungen@example.com"')
+    assert response.status_code == 200
+    assert [u['userName'] for u in response.json['Resources']] == ['Marcel.vdDungen@Example.com']
+
+    response = client.get('/scim/v2/users?filter=userName eq "straße"')
+    assert [u['userName'] for u in response.json['Resources']] == ['STRASSE']
+
+
+def test_list_users_with_quoted_filter_value(client):
+    """
+        Check that filter values are parsed as quoted strings including escapes
+    """
+    client.post('/scim/v2/users', data=json.dumps({'userName': 'name "with" quotes'}), content_type='application/json')
+
+    response = client.get('/scim/v2/users?filter=userName eq "name \\"with\\" quotes"')
+    assert response.status_code == 200
+    assert len(response.json['Resources']) == 1
+
+
+def test_list_users_with_case_exact_external_id_filter(client):
+    """
+        Check that externalId is matched case exactly
+    """
+    client.post('/scim/v2/users', data=json.dumps({'userName': 'username1', 'externalId': 'ABC'}), content_type='application/json')
+
+    response = client.get('/scim/v2/users?filter=externalId eq "abc"')
+    assert len(response.json['Resources']) == 0
+
+    response = client.get('/scim/v2/users?filter=externalId eq "ABC"')
+    assert len(response.json['Resources']) == 1
+
+
+def test_list_users_without_external_id_not_indexed(client):
+    """
+        Check that users without an externalId are not matched by an empty externalId filter
+    """
+    client.post('/scim/v2/users', data=json.dumps({'userName': 'username1'}), content_type='application/json')
+    client.post('/scim/v2/users', data=json.dumps({'userName': 'username2'}), content_type='application/json')
+
+    response = client.get('/scim/v2/users?filter=externalId eq ""')
+    assert response.status_code == 200
+    assert response.json['Resources'] == []
+    assert scimsim.user_indexes['externalId']['entries'] == {}
+
+
+def test_list_users_with_invalid_filter_returns_bad_request(client):
+    """
+        Check that GET /Users responds with 400 Bad Request when the filter cannot be parsed
+    """
+    response = client.get('/scim/v2/users?filter=userName eq username1')
+    assert response.status_code == 400
+    assert "urn:ietf:params:scim:api:messages:2.0:Error" in response.json["schemas"]
+
+
+def test_create_user_returns_conflict_when_username_differs_in_case(client):
+    """
+        Check that POST /Users responds with 409 Conflict when userName only differs in case
+    """
+    client.post('/scim/v2/users', data=json.dumps({'userName': 'username'}), content_type='application/json')
+    response = client.post('/scim/v2/users', data=json.dumps({'userName': 'UserName'}), content_type='application/json')
+    assert response.status_code == 409
+    assert response.json["detail"] == "user already exists"
+
+
+def test_update_user_updates_username_index(client):
+    """
+        Check that PUT /Users/<id> makes the new userName available to filters and frees the old one
+    """
+    response = client.post('/scim/v2/users', data=json.dumps({'userName': 'username1'}), content_type='application/json')
+    client.put('/scim/v2/users/' + str(response.json['id']), data=json.dumps({'userName': 'username2'}), content_type='application/json')
+
+    response = client.get('/scim/v2/users?filter=userName eq "username1"')
+    assert len(response.json['Resources']) == 0
+    response = client.get('/scim/v2/users?filter=userName eq "username2"')
+    assert len(response.json['Resources']) == 1
+
+    response = client.post('/scim/v2/users', data=json.dumps({'userName': 'username1'}), content_type='application/json')
+    assert response.status_code == 201
+
+
 def test_list_users_with_pagination(client):
     """
         Check that GET /Users?startIndex=1&count=2 responds with correct list
@@ -296,6 +385,23 @@ def test_add_user_with_invalid_patch_returns_bad_request(client):
     assert response.json['scimType'] == 'invalidSyntax'
 
 
+def test_patch_group_without_json_object_returns_bad_request(client):
+    """
+        Check that PATCH /Groups/<id> responds with 400 Bad Request when the body is not a JSON object
+    """
+    response = create_scim_group('groupname', client)
+    group_id = str(response.json['id'])
+
+    d = {'Operations': [{'op': 'add', 'path': 'members', 'value': [{'value': '0'}]}]}
+    response = client.patch('/scim/v2/groups/' + group_id, data=json.dumps(d))
+    assert response.status_code == 400
+    assert response.json['scimType'] == 'invalidSyntax'
+
+    response = client.patch('/scim/v2/groups/' + group_id, data=json.dumps([d]), content_type='application/json')
+    assert response.status_code == 400
+    assert response.json['scimType'] == 'invalidSyntax'
+
+
 def test_add_user_to_non_existing_group_returns_not_found(client):
     """
         Check that PATCH /Groups/<id> responds with 404 Not Found when group does not exist
@@ -355,6 +461,414 @@ def test_remove_user_returns_no_content_on_success(client):
     assert response.status_code == 204
 
 
+def test_get_user_returns_direct_and_indirect_groups(client):
+    """
+        Check that GET /Users/<id> lists the groups a user is a member of through nested groups
+    """
+    response = client.post('/scim/v2/users', data=json.dumps({'userName': 'username'}), content_type='application/json')
+    user_id = str(response.json['id'])
+    outer = str(create_scim_group('outer', client).json['id'])
+    inner = str(create_scim_group('inner', client).json['id'])
+
+    add_user_to_group({'value': inner, 'type': 'Group'}, outer, client)
+    add_user_to_group({'value': user_id}, inner, client)
+
+    response = client.get('/scim/v2/users/' + user_id)
+    assert response.status_code == 200
+    assert [(g['value'], g['display'], g['type']) for g in response.json['groups']] == \
+        [(outer, 'outer', 'indirect'), (inner, 'inner', 'direct')]
+
+    response = remove_user_from_group(outer, client, inner)
+    assert response.status_code == 204
+
+    response = client.get('/scim/v2/users/' + user_id)
+    assert [g['value'] for g in response.json['groups']] == [inner]
+
+
+def test_add_group_to_itself_through_nested_group_returns_bad_request(client):
+    """
+        Check that PATCH /Groups/<id> responds with 400 Bad Request when membership would create a cycle
+    """
+    outer = str(create_scim_group('outer', client).json['id'])
+    inner = str(create_scim_group('inner', client).json['id'])
+
+    add_user_to_group({'value': inner, 'type': 'Group'}, outer, client)
+    response = add_user_to_group({'value': outer, 'type': 'Group'}, inner, client)
+    assert response.status_code == 400
+
+    response = client.get('/scim/v2/groups/' + inner)
+    assert response.json['members'] == []
+
+
+def test_add_members_with_cycle_leaves_group_unchanged(client):
+    """
+        Check that PATCH /Groups/<id> applies none of the members when one of them would create a cycle
+    """
+    outer = str(create_scim_group('outer', client).json['id'])
+    inner = str(create_scim_group('inner', client).json['id'])
+    add_user_to_group({'value': inner, 'type': 'Group'}, outer, client)
+
+    d = {
+        'schemas': ["urn:ietf:params:scim:api:messages:2.0:PatchOp"],
+        'Operations': [{
+            'op': 'add',
+            'path': 'members',
+            'value': [{'value': '5'}, {'value': outer, 'type': 'Group'}]
+        }]
+    }
+    response = client.patch('/scim/v2/groups/' + inner, data=json.dumps(d), content_type='application/json')
+    assert response.status_code == 400
+    assert response.json['scimType'] == 'invalidValue'
+
+    response = client.get('/scim/v2/groups/' + inner)
+    assert response.json['members'] == []
+    response = client.get('/scim/v2/groups?filter=members eq "5"')
+    assert response.json['Resources'] == []
+
+
+def test_delete_group_removes_memberships(client):
+    """
+        Check that DELETE /Groups/<id> removes the group from its parents and its members' groups
+    """
+    response = client.post('/scim/v2/users', data=json.dumps({'userName': 'username'}), content_type='application/json')
+    user_id = str(response.json['id'])
+    outer = str(create_scim_group('outer', client).json['id'])
+    inner = str(create_scim_group('inner', client).json['id'])
+
+    add_user_to_group({'value': inner, 'type': 'Group'}, outer, client)
+    add_user_to_group({'value': user_id}, inner, client)
+    client.delete('/scim/v2/groups/' + inner)
+
+    response = client.get('/scim/v2/groups/' + outer)
+    assert response.json['members'] == []
+    response = client.get('/scim/v2/users/' + user_id)
+    assert 'groups' not in response.json
+
+
+def test_list_groups_with_members_filter(client):
+    """
+        Check that GET /Groups?filter=members[value eq "..."] returns the groups directly containing the member
+    """
+    first = str(create_scim_group('first', client).json['id'])
+    create_scim_group('second', client)
+    add_user_to_group({'value': '7'}, first, client)
+
+    response = client.get('/scim/v2/groups?filter=members[value eq "7"]')
+    assert response.status_code == 200
+    assert [g['displayName'] for g in response.json['Resources']] == ['first']
+
+    response = client.get('/scim/v2/groups?filter=members eq "7"')
+    assert [g['displayName'] for g in response.json['Resources']] == ['first']
+
+
+def test_create_group_with_members(client):
+    """
+        Check that POST /Groups with members registers the membership
+    """
+    response = client.post('/scim/v2/users', data=json.dumps({'userName': 'username'}), content_type='application/json')
+    user_id = str(response.json['id'])
+
+    d = {'displayName': 'groupname', 'members': [{'value': user_id}, {'value': user_id}, {'display': 'no value'}]}
+    response = client.post('/scim/v2/groups', data=json.dumps(d), content_type='application/json')
+    assert response.status_code == 201
+    group_id = str(response.json['id'])
+    assert [(m['value'], m['type']) for m in response.json['members']] == [(user_id, 'User')]
+
+    response = client.get('/scim/v2/users/' + user_id)
+    assert [g['value'] for g in response.json['groups']] == [group_id]
+    response = client.get('/scim/v2/groups?filter=members eq "' + user_id + '"')
+    assert [g['displayName'] for g in response.json['Resources']] == ['groupname']
+
+    response = remove_user_from_group(group_id, client, user_id)
+    assert response.status_code == 204
+    response = client.get('/scim/v2/groups/' + group_id)
+    assert response.json['members'] == []
+
+
+def test_create_group_containing_itself_returns_bad_request(client):
+    """
+        Check that POST /Groups responds with 400 Bad Request when the group would contain itself
+    """
+    d = {'displayName': 'groupname', 'members': [{'value': '0', 'type': 'Group'}]}
+    response = client.post('/scim/v2/groups', data=json.dumps(d), content_type='application/json')
+    assert response.status_code == 400
+
+    response = client.get('/scim/v2/groups')
+    assert response.json['Resources'] == []
+
+
+def test_add_member_with_invalid_value_returns_bad_request(client):
+    """
+        Check that PATCH /Groups/<id> responds with 400 Bad Request when a member value is not a string
+    """
+    group_id = str(create_scim_group('groupname', client).json['id'])
+    response = add_user_to_group({'value': 3, 'type': 'Group'}, group_id, client)
+    assert response.status_code == 400
+    assert response.json['detail'] == 'members.value must be a string'
+
+
+def test_transitive_groups_of_deep_hierarchy():
+    """
+        Check that transitive memberships of a deep chain of groups are resolved after invalidation
+    """
+    graph = scimsim.memberships.create_graph()
+    depth = 1500
+    for i in range(depth):
+        scimsim.memberships.add_member(graph, i, scimsim.memberships.group_node(i + 1))
+    leaf = scimsim.memberships.user_node(0)
+    scimsim.memberships.add_member(graph, depth, leaf)
+    assert len(scimsim.memberships.get_ancestors(graph, leaf)) == depth + 1
+
+    scimsim.memberships.remove_member(graph, 0, scimsim.memberships.group_node(1))
+    assert len(scimsim.memberships.get_ancestors(graph, leaf)) == depth
+    assert '0' not in scimsim.memberships.get_ancestors(graph, leaf)
+
+
+def test_update_group_replaces_members(client):
+    """
+        Check that PUT /Groups/<id> with members replaces the membership
+    """
+    group_id = str(create_scim_group('groupname', client).json['id'])
+    add_user_to_group({'value': '1'}, group_id, client)
+
+    d = {'displayName': 'groupname', 'members': [{'value': '2'}]}
+    response = client.put('/scim/v2/groups/' + group_id, data=json.dumps(d), content_type='application/json')
+    assert response.status_code == 200
+    assert [m['value'] for m in response.json['members']] == ['2']
+
+    response = client.get('/scim/v2/groups?filter=members eq "1"')
+    assert response.json['Resources'] == []
+
+
+def test_create_user_keeps_schema_attributes(client):
+    """
+        Check that POST /Users stores all attributes defined by the User schema and its extensions
+    """
+    d = {
+        'schemas': ['urn:ietf:params:scim:schemas:core:2.0:User',
+                    'urn:ietf:params:scim:schemas:extension:enterprise:2.0:User'],
+        'UserName': 'mvandend',
+        'name': {'givenName': 'Marcel', 'familyName': 'van den Dungen'},
+        'emails': [{'value': 'mvandend@example.com', 'type': 'work', 'primary': True}],
+        'password': 'secret',
+        'unknownAttribute': 'ignored',
+        'urn:ietf:params:scim:schemas:extension:enterprise:2.0:User': {'employeeNumber': '42'}
+    }
+    response = client.post('/scim/v2/users', data=json.dumps(d), content_type='application/json')
+    assert response.status_code == 201
+    assert response.json['userName'] == 'mvandend'
+    assert response.json['name']['givenName'] == 'Marcel'
+    assert response.json['emails'][0]['value'] == 'mvandend@example.com'
+    assert response.json['urn:ietf:params:scim:schemas:extension:enterprise:2.0:User']['employeeNumber'] == '42'
+    assert 'urn:ietf:params:scim:schemas:extension:enterprise:2.0:User' in response.json['schemas']
+    assert 'password' not in response.json
+    assert 'unknownAttribute' not in response.json
+
+
+def test_create_user_returns_bad_request_when_attribute_has_wrong_type(client):
+    """
+        Check that POST /Users responds with 400 Bad Request when an attribute does not match the schema
+    """
+    d = {'userName': 'mvandend', 'emails': {'value': 'mvandend@example.com'}}
+    response = client.post('/scim/v2/users', data=json.dumps(d), content_type='application/json')
+    assert response.status_code == 400
+    assert response.json['detail'] == 'emails must be multi-valued'
+    assert response.json['scimType'] == 'invalidValue'
+
+    d = {'userName': 'mvandend', 'name': {'givenName': 1}}
+    response = client.post('/scim/v2/users', data=json.dumps(d), content_type='application/json')
+    assert response.status_code == 400
+    assert response.json['detail'] == 'name.givenName must be a string'
+
+
+def test_create_user_with_custom_schema_extension(client):
+    """
+        Check that a registered schema extension is validated and listed under /Schemas
+    """
+    scimsim.add_schema_extension('User', {
+        'id': 'urn:example:params:scim:schemas:extension:test:2.0:User',
+        'name': 'TestUser',
+        'description': 'Test extension',
+        'attributes': [{'name': 'badge', 'type': 'integer', 'multiValued': False, 'description': '',
+                        'required': True, 'caseExact': False, 'mutability': 'readWrite',
+                        'returned': 'default', 'uniqueness': 'none'}]
+    }, required=True)
+    try:
+        d = {'userName': 'mvandend'}
+        response = client.post('/scim/v2/users', data=json.dumps(d), content_type='application/json')
+        assert response.status_code == 400
+        assert response.json['detail'] == 'urn:example:params:scim:schemas:extension:test:2.0:User is missing'
+
+        d['urn:example:params:scim:schemas:extension:test:2.0:User'] = {'badge': 7}
+        response = client.post('/scim/v2/users', data=json.dumps(d), content_type='application/json')
+        assert response.status_code == 201
+        assert response.json['urn:example:params:scim:schemas:extension:test:2.0:User']['badge'] == 7
+
+        response = client.get('/scim/v2/Schemas/urn:example:params:scim:schemas:extension:test:2.0:User')
+        assert response.status_code == 200
+        assert response.json['name'] == 'TestUser'
+    finally:
+        scimsim.remove_schema_extension('User', 'urn:example:params:scim:schemas:extension:test:2.0:User')
+
+
+def test_create_group_returns_meta(client):
+    """
+        Check that POST /Groups responds with a SCIM meta attribute
+    """
+    response = create_scim_group('groupname', client)
+    assert response.json['meta']['resourceType'] == 'Group'
+    assert response.json['meta']['location'] == '/scim/v2/groups/' + str(response.json['id'])
+    assert 'metadata' not in response.json
+
+
+def test_list_schemas_returns_ok(client):
+    """
+        Check that GET /Schemas lists the core and enterprise schemas
+    """
+    response = client.get('/scim/v2/Schemas')
+    assert response.status_code == 200
+    ids = [s['id'] for s in response.json['Resources']]
+    assert 'urn:ietf:params:scim:schemas:core:2.0:User' in ids
+    assert 'urn:ietf:params:scim:schemas:core:2.0:Group' in ids
+    assert 'urn:ietf:params:scim:schemas:extension:enterprise:2.0:User' in ids
+
+
+def test_get_schema_returns_not_found_when_schema_does_not_exist(client):
+    """
+        Check that GET /Schemas/<id> responds with 404 Not Found when schema does not exist
+    """
+    response = client.get('/scim/v2/Schemas/urn:unknown')
+    assert response.status_code == 404
+    assert response.json['detail'] == 'schema not found'
+
+
+def test_list_resource_types_returns_ok(client):
+    """
+        Check that GET /ResourceTypes lists the User and Group resource types
+    """
+    response = client.get('/scim/v2/ResourceTypes')
+    assert response.status_code == 200
+    assert [r['name'] for r in response.json['Resources']] == ['User', 'Group']
+
+    response = client.get('/scim/v2/ResourceTypes/User')
+    assert response.status_code == 200
+    assert response.json['schemaExtensions'][0]['schema'] == 'urn:ietf:params:scim:schemas:extension:enterprise:2.0:User'
+
+
+def test_get_service_provider_config_returns_ok(client):
+    """
+        Check that GET /ServiceProviderConfig responds with 200 OK
+    """
+    response = client.get('/scim/v2/ServiceProviderConfig')
+    assert response.status_code == 200
+    assert "urn:ietf:params:scim:schemas:core:2.0:ServiceProviderConfig" in response.json["schemas"]
+    assert response.json['patch']['supported'] == True
+    assert response.json['filter']['maxResults'] == 200
+
+
+def test_resource_type_endpoints_are_routed(client):
+    """
+        Check that the endpoints advertised by /ResourceTypes can be used to reach the resources
+    """
+    response = client.get('/scim/v2/ResourceTypes')
+    endpoints = {r['name']: r['endpoint'] for r in response.json['Resources']}
+
+    response = client.post('/scim/v2' + endpoints['User'], data=json.dumps({'userName': 'username'}), content_type='application/json')
+    assert response.status_code == 201
+    response = client.get('/scim/v2' + endpoints['User'] + '/' + str(response.json['id']))
+    assert response.status_code == 200
+
+    response = client.post('/scim/v2' + endpoints['Group'], data=json.dumps({'displayName': 'groupname'}), content_type='application/json')
+    assert response.status_code == 201
+    response = client.get('/scim/v2' + endpoints['Group'])
+    assert response.status_code == 200
+    assert len(response.json['Resources']) == 1
+
+
+def test_list_groups_caps_count_at_max_results(client):
+    """
+        Check that GET /Groups never returns more than the advertised maxResults
+    """
+    response = client.get('/scim/v2/groups?count=1000')
+    assert response.status_code == 200
+    assert response.json['itemsPerPage'] == 200
+
+
+def test_server_timing_header_when_timing_enabled(client):
+    """
+        Check that responses carry a Server-Timing header with phase durations while timing is enabled
+    """
+    response = client.get('/scim/v2/users/0')
+    assert 'Server-Timing' not in response.headers
+
+    response = client.put('/admin/profiling', data=json.dumps({'timing': True}), content_type='application/json')
+    assert response.status_code == 200
+    assert response.json['timing'] == True
+    try:
+        response = client.post('/scim/v2/users', data=json.dumps({'userName': 'username'}), content_type='application/json')
+        phases = [entry.split(';')[0] for entry in response.headers['Server-Timing'].split(', ')]
+        assert phases == ['log', 'parse', 'lookup', 'mutate', 'serialize', 'total']
+
+        response = client.get('/scim/v2/users/' + str(response.json['id']))
+        phases = [entry.split(';')[0] for entry in response.headers['Server-Timing'].split(', ')]
+        assert 'lookup' in phases
+    finally:
+        client.put('/admin/profiling', data=json.dumps({'timing': False}), content_type='application/json')
+
+
+def test_timed_helpers_run_outside_request_when_timing_disabled():
+    """
+        Check that instrumented helpers do not need flask.g while timing is off
+    """
+    # flask.g raises RuntimeError outside an application context, so any access would fail here
+    assert not flask.has_app_context()
+    assert scimsim.profiling.settings['timing'] == False
+    from scimsim.app import parse_filter
+    assert parse_filter('userName eq "username"') == ('userName', 'username')
+
+    with scimsim.profiling.phase('lookup'):
+        pass
+
+
+def test_update_profiling_returns_bad_request_when_settings_invalid(client):
+    """
+        Check that PUT /admin/profiling responds with 400 Bad Request for invalid settings
+    """
+    response = client.put('/admin/profiling', data=json.dumps({'sampleRate': 2}), content_type='application/json')
+    assert response.status_code == 400
+    assert response.json['detail'] == 'sampleRate must be a number between 0 and 1'
+
+    response = client.put('/admin/profiling', data=json.dumps({'sampling': 'yes'}), content_type='application/json')
+    assert response.status_code == 400
+
+
+def test_flamegraph_contains_sampled_request_stacks(client):
+    """
+        Check that GET /admin/profiling/flamegraph returns collapsed stacks of sampled requests
+    """
+    client.delete('/admin/profiling/flamegraph')
+    client.put('/admin/profiling', data=json.dumps({'sampling': True, 'interval': 0.001}), content_type='application/json')
+    try:
+        deadline = time.time() + 5
+        stacks = ''
+        while not stacks and time.time() < deadline:
+            for i in range(20):
+                client.post('/scim/v2/users', data=json.dumps({'userName': 'username' + str(i)}), content_type='application/json')
+            stacks = client.get('/admin/profiling/flamegraph').get_data(as_text=True)
+            scimsim.clear_data()
+    finally:
+        client.put('/admin/profiling', data=json.dumps({'sampling': False, 'interval': 0.005}), content_type='application/json')
+
+    assert stacks
+    stack, count = stacks.splitlines()[0].rsplit(' ', 1)
+    assert int(count) > 0
+    assert stack.startswith('POST /scim/v2/users;')
+
+    response = client.delete('/admin/profiling/flamegraph')
+    assert response.status_code == 204
+    assert client.get('/admin/profiling/flamegraph').get_data(as_text=True) == ''
+
+
 def create_scim_group(groupname, client):
     d = {'displayName': groupname}
     response = client.post('/scim/v2/groups', data=json.dumps(d), content_type='application/json')
@@ -376,13 +890,13 @@ def add_user_to_group(user, id, client):
     return response
 
 
-def remove_user_from_group(id, client):
+def remove_user_from_group(id, client, value='0'):
     d = {
 	'schemas': ["urn:ietf:params:scim:api:messages:2.0:PatchOp"],
     'Operations': [
         {
             'op': 'remove',
-            'path': 'members[value eq "0"]'
+            'path': 'members[value eq "' + value + '"]'
         }]
     }
     response = client.patch('/scim/v2/groups/' + id, data=json.dumps(d), content_type='application/json')